@@ -3,16 +3,21 @@ from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import uuid
+import atexit
 from datetime import datetime
-import numpy as np
 from sentence_transformers import SentenceTransformer
 from pymongo import MongoClient
 import PyPDF2
 import docx
 import requests
-import faiss
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from collection_store import (
+    DEFAULT_COLLECTION,
+    CollectionManager,
+    collection_filter,
+    get_collection_name,
+)
 
 app = Flask(__name__)
 CORS(app)
@@ -22,6 +27,8 @@ UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
 OLLAMA_BASE_URL = "http://localhost:11434"
 ALLOWED_MODELS = ['gemma3:1b', 'mistral:latest', 'llama3.2:1b']
+SNAPSHOT_FOLDER = 'snapshots'
+MAX_LOADED_COLLECTIONS = 8
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -32,6 +39,7 @@ try:
     db = client['starrag_bot']
     documents_collection = db['documents']
     conversations_collection = db['conversations']
+    documents_collection.create_index('collection')
     print("✅ MongoDB connected successfully")
 except Exception as e:
     print(f"⚠️ MongoDB connection failed: {e}")
@@ -40,8 +48,9 @@ except Exception as e:
     client = None
 
 embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-faiss_index = None
-document_chunks = []
+
+collections = CollectionManager(SNAPSHOT_FOLDER, MAX_LOADED_COLLECTIONS, documents_collection)
+atexit.register(collections.flush)
 
 class RAGPipeline:
     def __init__(self):
@@ -80,10 +89,8 @@ class RAGPipeline:
             
         return text
 
-    def process_document(self, file_path, filename):
-        """Process a document and add it to the vector store"""
-        global faiss_index, document_chunks
-        
+    def process_document(self, file_path, filename, collection_name=DEFAULT_COLLECTION):
+        """Process a document and add it to a collection's vector store"""
         # Extract text
         text = self.extract_text_from_file(file_path, filename)
         if not text:
@@ -101,6 +108,7 @@ class RAGPipeline:
         doc_id = str(uuid.uuid4())
         document_data = {
             "_id": doc_id,
+            "collection": collection_name,
             "filename": filename,
             "content": text,
             "chunks": [
@@ -118,52 +126,24 @@ class RAGPipeline:
             try:
                 documents_collection.insert_one(document_data)
             except Exception as e:
-                print(f"Warning: Could not store document in MongoDB: {e}")
+                # Don't index what MongoDB doesn't know about
+                print(f"Error: Could not store document in MongoDB: {e}")
+                return False
         else:
-            print("Warning: MongoDB not available - document not persisted")
-        
-        # Add to FAISS index
-        if faiss_index is None:
-            dimension = embeddings.shape[1]
-            faiss_index = faiss.IndexFlatL2(dimension)
-            document_chunks = []
+            print("Warning: MongoDB not available - document only kept in the index snapshot")
         
-        faiss_index.add(embeddings.astype('float32'))
-        
-        for i, chunk in enumerate(chunks):
-            document_chunks.append({
-                "text": chunk.page_content,
-                "metadata": chunk.metadata,
-                "doc_id": doc_id
-            })
+        # Add to the collection's FAISS index
+        collections.add_document(collection_name, doc_id, embeddings, document_data["chunks"])
         
         return True
 
-    def similarity_search(self, query, k=5):
-        """Search for similar chunks using FAISS"""
-        global faiss_index, document_chunks
-        
-        if faiss_index is None or len(document_chunks) == 0:
-            return []
-        
+    def similarity_search(self, query, k=5, collection_name=DEFAULT_COLLECTION):
+        """Search for similar chunks in a collection using FAISS"""
         # Generate query embedding
         query_embedding = self.embedding_model.encode([query])
         
         # Search in FAISS
-        distances, indices = faiss_index.search(query_embedding.astype('float32'), k)
-        
-        # Return relevant chunks
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(document_chunks):
-                chunk = document_chunks[idx]
-                results.append({
-                    "text": chunk["text"],
-                    "metadata": chunk["metadata"],
-                    "score": float(distances[0][i])
-                })
-        
-        return results
+        return collections.search(collection_name, query_embedding, k)
 
     def generate_response(self, query, context_chunks, model="gemma3:1b"):
         """Generate response using Ollama"""
@@ -256,17 +236,27 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
+    collection_name = get_collection_name(request.form)
+    if collection_name is None:
+        return jsonify({'error': 'Invalid collection name'}), 400
+    
     if file and rag_pipeline.allowed_file(file.filename):
         filename = secure_filename(file.filename)
         file_path = os.path.join(UPLOAD_FOLDER, filename)
         file.save(file_path)
         
-        success = rag_pipeline.process_document(file_path, filename)
-        
-        os.remove(file_path)
+        try:
+            success = rag_pipeline.process_document(file_path, filename, collection_name)
+        except Exception as e:
+            return jsonify({'error': f'Failed to index document: {e}'}), 500
+        finally:
+            os.remove(file_path)
         
         if success:
-            return jsonify({'message': f'File {filename} processed successfully'})
+            return jsonify({
+                'message': f'File {filename} processed successfully',
+                'collection': collection_name
+            })
         else:
             return jsonify({'error': 'Failed to process document'}), 500
     
@@ -274,7 +264,11 @@ def upload_file():
 
 @app.route('/api/documents', methods=['GET'])
 def get_documents():
-    """Get list of uploaded documents"""
+    """Get list of uploaded documents in a collection"""
+    collection_name = get_collection_name(request.args)
+    if collection_name is None:
+        return jsonify({'error': 'Invalid collection name'}), 400
+    
     if documents_collection is None:
         return jsonify({
             'documents': [],
@@ -282,8 +276,12 @@ def get_documents():
         })
     
     try:
-        docs = list(documents_collection.find({}, {'filename': 1, 'created_at': 1}))
+        docs = list(documents_collection.find(
+            collection_filter(collection_name),
+            {'filename': 1, 'created_at': 1}
+        ))
         return jsonify({
+            'collection': collection_name,
             'documents': [
                 {
                     'id': str(doc['_id']),
@@ -301,44 +299,25 @@ def get_documents():
 
 @app.route('/api/documents/<doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
-    """Delete a document"""
+    """Delete a document from a collection"""
+    collection_name = get_collection_name(request.args)
+    if collection_name is None:
+        return jsonify({'error': 'Invalid collection name'}), 400
+    
     if documents_collection is None:
         return jsonify({'error': 'MongoDB not available'}), 500
     
     try:
         # Remove document from MongoDB
-        result = documents_collection.delete_one({'_id': doc_id})
+        result = documents_collection.delete_one({
+            '$and': [{'_id': doc_id}, collection_filter(collection_name)]
+        })
         
         if result.deleted_count == 0:
             return jsonify({'error': 'Document not found'}), 404
             
-        # Rebuild FAISS index without this document
-        global faiss_index, document_chunks
-        
-        if faiss_index is not None:
-            all_docs = list(documents_collection.find())
-            
-            faiss_index = None
-            document_chunks = []
-            
-            if all_docs:
-                all_embeddings = []
-                
-                for doc in all_docs:
-                    for chunk in doc.get("chunks", []):
-                        embedding = np.array(chunk["embedding"])
-                        all_embeddings.append(embedding)
-                        document_chunks.append({
-                            "text": chunk["text"],
-                            "metadata": chunk["metadata"],
-                            "doc_id": doc["_id"]
-                        })
-                
-                if all_embeddings:
-                    embeddings_array = np.vstack(all_embeddings)
-                    dimension = embeddings_array.shape[1]
-                    faiss_index = faiss.IndexFlatL2(dimension)
-                    faiss_index.add(embeddings_array.astype('float32'))
+        # Drop the collection's index so it is rebuilt without this document
+        collections.invalidate(collection_name)
         
         return jsonify({'message': 'Document deleted successfully'})
     except Exception as e:
@@ -393,22 +372,30 @@ def query():
     user_query = data.get('query', '')
     model = data.get('model', 'gemma3:1b')
     conversation_id = data.get('conversation_id')
+    collection_name = get_collection_name(data)
     
     if not user_query:
         return jsonify({'error': 'No query provided'}), 400
     
+    if collection_name is None:
+        return jsonify({'error': 'Invalid collection name'}), 400
+    
     # Validate model
     if model not in ALLOWED_MODELS:
         return jsonify({'error': f'Model {model} is not allowed'}), 400
     
     # Search for relevant chunks
-    relevant_chunks = rag_pipeline.similarity_search(user_query, k=5)
+    try:
+        relevant_chunks = rag_pipeline.similarity_search(user_query, k=5, collection_name=collection_name)
+    except Exception as e:
+        return jsonify({'error': f'Failed to search collection: {e}'}), 500
     
     if not relevant_chunks:
         return jsonify({
             'response': 'I have no relevant information. Please upload documents first.',
             'sources': [],
-            'conversation_id': conversation_id
+            'conversation_id': conversation_id,
+            'collection': collection_name
         })
     
     # Generate response
@@ -423,6 +410,7 @@ def query():
         'query': user_query,
         'response': response,
         'model': model,
+        'collection': collection_name,
         'sources': list(set([chunk['metadata'].get('source', 'Unknown') for chunk in relevant_chunks])),
         'timestamp': datetime.utcnow()
     }
@@ -436,7 +424,27 @@ def query():
     return jsonify({
         'response': response,
         'sources': list(set([chunk['metadata'].get('source', 'Unknown') for chunk in relevant_chunks])),
-        'conversation_id': conversation_id
+        'conversation_id': conversation_id,
+        'collection': collection_name
+    })
+
+@app.route('/api/collections', methods=['GET'])
+def list_collections():
+    """List known collections and whether they are loaded in memory"""
+    names = collections.names()
+    names.add(DEFAULT_COLLECTION)
+    
+    if documents_collection is not None:
+        try:
+            names.update(n for n in documents_collection.distinct('collection') if n)
+        except Exception as e:
+            print(f"Warning: Could not list collections from MongoDB: {e}")
+    
+    return jsonify({
+        'collections': [
+            {'name': name, 'loaded': collections.is_loaded(name)}
+            for name in sorted(names)
+        ]
     })
 
 @app.route('/api/conversations', methods=['GET'])
@@ -488,32 +496,13 @@ def get_conversation(conversation_id):
         return jsonify({'conversations': [], 'error': str(e)})
 
 if __name__ == '__main__':
-    # Load existing documents on startup
-    if documents_collection is not None:
-        try:
-            docs = list(documents_collection.find())
-            if docs:
-                all_embeddings = []
-                document_chunks = []
-                
-                for doc in docs:
-                    for chunk in doc.get("chunks", []):
-                        embedding = np.array(chunk["embedding"])
-                        all_embeddings.append(embedding)
-                        document_chunks.append({
-                            "text": chunk["text"],
-                            "metadata": chunk["metadata"],
-                            "doc_id": doc["_id"]
-                        })
-                
-                if all_embeddings:
-                    embeddings_array = np.vstack(all_embeddings)
-                    dimension = embeddings_array.shape[1]
-                    faiss_index = faiss.IndexFlatL2(dimension)
-                    faiss_index.add(embeddings_array.astype('float32'))
-                    print(f"✅ Loaded {len(docs)} documents with {len(document_chunks)} chunks")
-        except Exception as e:
-            print(f"⚠️ Error loading existing documents: {e}")
+    # Warm up the default collection; others are loaded on first use
+    try:
+        default_collection = collections.get(DEFAULT_COLLECTION)
+        if default_collection.chunks:
+            print(f"✅ Loaded collection '{DEFAULT_COLLECTION}' with {len(default_collection.chunks)} chunks")
+    except Exception as e:
+        print(f"⚠️ Error loading existing documents: {e}")
     
     print("🚀 StarRAG Bot API starting...")
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import threading
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+DEFAULT_COLLECTION = 'default'
+COLLECTION_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def collection_filter(name):
+    """MongoDB filter for the documents of a collection.
+
+    Documents stored before collections existed have no 'collection' field
+    and belong to the default collection.
+    """
+    if name == DEFAULT_COLLECTION:
+        return {'$or': [{'collection': name}, {'collection': {'$exists': False}}]}
+    return {'collection': name}
+
+
+def get_collection_name(params):
+    """Read and validate the collection name from request parameters"""
+    name = params.get('collection') or DEFAULT_COLLECTION
+    if not isinstance(name, str):
+        return None
+    name = name.strip()
+    if not COLLECTION_NAME_PATTERN.match(name):
+        return None
+    return name
+
+
+class Collection:
+    """FAISS index and chunk list for a single knowledge base"""
+    def __init__(self, name, index=None, chunks=None, doc_ids=None):
+        self.name = name
+        self.index = index
+        self.chunks = chunks if chunks is not None else []
+        self.doc_ids = set(doc_ids) if doc_ids is not None else set()
+        self.lock = threading.Lock()
+        # Set when the in-memory state differs from the snapshot on disk
+        self.dirty = False
+        # Set once the manager has dropped this object; it must not be
+        # written to or snapshotted any more.
+        self.dead = False
+
+    def add(self, embeddings, chunks, doc_id):
+        """Index a document's chunks; returns False if it is already indexed"""
+        if doc_id in self.doc_ids:
+            return False
+
+        if len(chunks):
+            if self.index is None:
+                self.index = faiss.IndexFlatL2(embeddings.shape[1])
+
+            self.index.add(np.asarray(embeddings, dtype='float32'))
+
+            for chunk in chunks:
+                self.chunks.append({
+                    "text": chunk["text"],
+                    "metadata": chunk["metadata"],
+                    "doc_id": doc_id
+                })
+
+        self.doc_ids.add(doc_id)
+        self.dirty = True
+        return True
+
+    def search(self, query_embedding, k):
+        if self.index is None or len(self.chunks) == 0:
+            return []
+
+        distances, indices = self.index.search(np.asarray(query_embedding, dtype='float32'), k)
+
+        results = []
+        for i, idx in enumerate(indices[0]):
+            if 0 <= idx < len(self.chunks):
+                chunk = self.chunks[idx]
+                results.append({
+                    "text": chunk["text"],
+                    "metadata": chunk["metadata"],
+                    "score": float(distances[0][i])
+                })
+
+        return results
+
+
+class CollectionManager:
+    """Keeps recently used collections in memory under an LRU budget.
+
+    Changes are made in memory and written to a snapshot on disk when a
+    collection is evicted or on shutdown (see flush), so cold collections
+    can be reloaded from their snapshot, or rebuilt from MongoDB, on the
+    next request. MongoDB stays the source of truth: a snapshot whose
+    documents differ from the ones stored there is discarded and rebuilt.
+    """
+    def __init__(self, snapshot_folder, max_loaded, documents=None):
+        self.snapshot_folder = snapshot_folder
+        self.max_loaded = max_loaded
+        self.documents = documents
+        self.loaded = OrderedDict()
+        # Guards the dicts below only; loads and disk writes happen outside it.
+        self.lock = threading.Lock()
+        # name -> [lock serialising loads of that name, number of users]
+        self.loading = {}
+        # name -> (evicted collection, event set once it has been written)
+        self.evicting = {}
+        self.generations = {}
+        os.makedirs(snapshot_folder, exist_ok=True)
+
+    def _snapshot_paths(self, name):
+        base = os.path.join(self.snapshot_folder, name)
+        return f"{base}.faiss", f"{base}.json"
+
+    def _stored_doc_ids(self, name):
+        return {doc["_id"] for doc in self.documents.find(collection_filter(name), {'_id': 1})}
+
+    def _load_snapshot(self, name):
+        index_path, chunks_path = self._snapshot_paths(name)
+        if not (os.path.exists(index_path) and os.path.exists(chunks_path)):
+            return None
+
+        try:
+            index = faiss.read_index(index_path)
+            with open(chunks_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            chunks, doc_ids = data["chunks"], data["doc_ids"]
+        except Exception as e:
+            print(f"⚠️ Could not read snapshot for collection '{name}': {e}")
+            return None
+
+        if index.ntotal != len(chunks):
+            print(f"⚠️ Snapshot for collection '{name}' is inconsistent, rebuilding")
+            return None
+
+        if self.documents is not None and set(doc_ids) != self._stored_doc_ids(name):
+            print(f"⚠️ Snapshot for collection '{name}' is out of date, rebuilding")
+            return None
+
+        return Collection(name, index, chunks, doc_ids)
+
+    def _rebuild_from_mongo(self, name):
+        collection = Collection(name)
+        if self.documents is None:
+            return collection
+
+        for doc in self.documents.find(collection_filter(name)):
+            doc_chunks = doc.get("chunks", [])
+            embeddings = np.array([chunk["embedding"] for chunk in doc_chunks])
+            collection.add(embeddings, doc_chunks, doc["_id"])
+
+        return collection
+
+    def _load(self, name):
+        collection = self._load_snapshot(name)
+        if collection is not None:
+            print(f"📂 Loaded collection '{name}' from snapshot ({len(collection.chunks)} chunks)")
+            return collection
+        return self._rebuild_from_mongo(name)
+
+    def save_snapshot(self, collection):
+        """Write a collection to disk; the caller must hold collection.lock"""
+        if collection.dead or not collection.dirty or collection.index is None:
+            return
+
+        index_path, chunks_path = self._snapshot_paths(collection.name)
+        try:
+            faiss.write_index(collection.index, index_path + '.tmp')
+            with open(chunks_path + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump({
+                    "doc_ids": sorted(collection.doc_ids),
+                    "chunks": collection.chunks
+                }, file)
+            os.replace(index_path + '.tmp', index_path)
+            os.replace(chunks_path + '.tmp', chunks_path)
+            collection.dirty = False
+        except Exception as e:
+            print(f"Warning: Could not write snapshot for collection '{collection.name}': {e}")
+
+    def _retire(self, collection, save):
+        with collection.lock:
+            if save:
+                self.save_snapshot(collection)
+            collection.dead = True
+
+    def _evict(self, collection, done):
+        self._retire(collection, save=True)
+        with self.lock:
+            if self.evicting.get(collection.name, (None,))[0] is collection:
+                del self.evicting[collection.name]
+        done.set()
+        print(f"♻️ Evicted collection '{collection.name}' from memory")
+
+    def get(self, name, create=False):
+        """Return a collection, loading it and evicting cold ones if needed.
+
+        A collection without any documents is only kept in memory when
+        ``create`` is set, so lookups of unknown names cannot push hot
+        collections out of the LRU.
+        """
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                return self.loaded[name]
+            entry = self.loading.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                return self._get_or_load(name, create)
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.loading[name]
+
+    def _get_or_load(self, name, create):
+        """Body of get(); the caller holds the per-name loading lock"""
+        while True:
+            with self.lock:
+                if name in self.loaded:
+                    self.loaded.move_to_end(name)
+                    return self.loaded[name]
+                generation = self.generations.get(name, 0)
+                pending = self.evicting.get(name)
+
+            if pending is not None:
+                # Reload only once the evicted copy has reached the disk
+                pending[1].wait()
+
+            collection = self._load(name)
+
+            evicted = []
+            with self.lock:
+                if self.generations.get(name, 0) != generation:
+                    # Invalidated while loading; the result may be stale
+                    continue
+                if name in self.loaded:
+                    self.loaded.move_to_end(name)
+                    return self.loaded[name]
+                if not collection.doc_ids and not create:
+                    return collection
+                self.loaded[name] = collection
+                while len(self.loaded) > self.max_loaded:
+                    old = self.loaded.popitem(last=False)[1]
+                    done = threading.Event()
+                    self.evicting[old.name] = (old, done)
+                    evicted.append((old, done))
+
+            for old, done in evicted:
+                self._evict(old, done)
+
+            return collection
+
+    def add_document(self, name, doc_id, embeddings, chunks):
+        """Index a document's chunks in a collection"""
+        while True:
+            collection = self.get(name, create=True)
+            with collection.lock:
+                if collection.dead:
+                    continue
+                collection.add(embeddings, chunks, doc_id)
+                return
+
+    def search(self, name, query_embedding, k):
+        collection = self.get(name)
+        with collection.lock:
+            return collection.search(query_embedding, k)
+
+    def invalidate(self, name):
+        """Drop a collection from memory and disk so it is rebuilt from MongoDB"""
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+            stale = [self.loaded.pop(name, None), self.evicting.get(name, (None,))[0]]
+
+        for collection in stale:
+            if collection is not None:
+                self._retire(collection, save=False)
+
+        for path in self._snapshot_paths(name):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def flush(self):
+        """Write every loaded collection with unsaved changes to disk"""
+        with self.lock:
+            loaded = list(self.loaded.values())
+
+        for collection in loaded:
+            with collection.lock:
+                self.save_snapshot(collection)
+
+    def names(self):
+        """Names of all known collections, loaded or not"""
+        with self.lock:
+            names = set(self.loaded)
+        names.update(
+            filename.rsplit('.', 1)[0]
+            for filename in os.listdir(self.snapshot_folder)
+            if filename.endswith('.faiss')
+        )
+        return names
+
+    def is_loaded(self, name):
+        with self.lock:
+            return name in self.loaded
@@ -0,0 +1,266 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from collection_store import (
+    DEFAULT_COLLECTION,
+    CollectionManager,
+    get_collection_name,
+)
+
+DIMENSION = 4
+
+
+class FakeDocuments:
+    """Just enough of a pymongo collection for CollectionManager"""
+    def __init__(self):
+        self.docs = {}
+
+    def _matches(self, doc, query):
+        if '$or' in query:
+            return any(self._matches(doc, q) for q in query['$or'])
+        for key, value in query.items():
+            if isinstance(value, dict) and '$exists' in value:
+                if (key in doc) != value['$exists']:
+                    return False
+            elif doc.get(key) != value:
+                return False
+        return True
+
+    def insert_one(self, doc):
+        self.docs[doc['_id']] = doc
+
+    def delete_one(self, doc_id):
+        del self.docs[doc_id]
+
+    def find(self, query=None, projection=None):
+        return [doc for doc in self.docs.values() if self._matches(doc, query or {})]
+
+
+def make_document(doc_id, collection, texts):
+    rng = np.random.default_rng(abs(hash(doc_id)) % (2 ** 32))
+    embeddings = rng.random((len(texts), DIMENSION)).astype('float32')
+    doc = {
+        "_id": doc_id,
+        "collection": collection,
+        "chunks": [
+            {"text": text, "metadata": {"source": doc_id}, "embedding": embedding.tolist()}
+            for text, embedding in zip(texts, embeddings)
+        ],
+    }
+    return doc, embeddings
+
+
+def upload(manager, documents, doc_id, collection, texts):
+    """Mirror RAGPipeline.process_document: persist first, then index"""
+    doc, embeddings = make_document(doc_id, collection, texts)
+    documents.insert_one(doc)
+    manager.add_document(collection, doc_id, embeddings, doc["chunks"])
+    return embeddings
+
+
+def chunk_texts(collection):
+    return sorted(chunk["text"] for chunk in collection.chunks)
+
+
+@pytest.fixture
+def documents():
+    return FakeDocuments()
+
+
+@pytest.fixture
+def manager(tmp_path, documents):
+    return CollectionManager(str(tmp_path), 2, documents)
+
+
+def test_first_upload_to_new_collection_indexes_chunks_once(manager, documents):
+    upload(manager, documents, "doc1", "kb", ["a", "b"])
+
+    collection = manager.get("kb")
+    assert chunk_texts(collection) == ["a", "b"]
+    assert collection.index.ntotal == 2
+
+
+def test_first_upload_without_mongo_is_kept(tmp_path):
+    manager = CollectionManager(str(tmp_path), 2)
+    doc, embeddings = make_document("doc1", "kb", ["a"])
+    manager.add_document("kb", "doc1", embeddings, doc["chunks"])
+
+    assert manager.is_loaded("kb")
+    manager.flush()
+    assert chunk_texts(CollectionManager(str(tmp_path), 2).get("kb")) == ["a"]
+
+
+def test_delete_then_upload(manager, documents, tmp_path):
+    upload(manager, documents, "doc1", "kb", ["a"])
+    upload(manager, documents, "doc2", "kb", ["b"])
+
+    documents.delete_one("doc1")
+    manager.invalidate("kb")
+    upload(manager, documents, "doc3", "kb", ["c"])
+
+    assert chunk_texts(manager.get("kb")) == ["b", "c"]
+    manager.flush()
+    reloaded = CollectionManager(str(tmp_path), 2, documents)
+    assert chunk_texts(reloaded.get("kb")) == ["b", "c"]
+
+
+def test_invalidated_collection_is_not_snapshotted(manager, documents, tmp_path):
+    upload(manager, documents, "doc1", "kb", ["a"])
+    stale = manager.get("kb")
+
+    documents.delete_one("doc1")
+    manager.invalidate("kb")
+    with stale.lock:
+        manager.save_snapshot(stale)
+
+    assert stale.dead
+    assert not (tmp_path / "kb.faiss").exists()
+    assert manager.get("kb").chunks == []
+
+
+def test_invalidate_twice(manager, documents, tmp_path):
+    upload(manager, documents, "doc1", "kb", ["a"])
+    manager.flush()
+    assert (tmp_path / "kb.faiss").exists()
+
+    manager.invalidate("kb")
+    manager.invalidate("kb")
+    assert not (tmp_path / "kb.faiss").exists()
+
+
+def test_upload_does_not_write_snapshot(manager, documents, tmp_path):
+    upload(manager, documents, "doc1", "kb", ["a"])
+    assert not (tmp_path / "kb.faiss").exists()
+
+    manager.flush()
+    assert (tmp_path / "kb.faiss").exists()
+    assert not manager.get("kb").dirty
+
+
+def test_concurrent_uploads_during_load(manager, documents):
+    reader_loading, reader_release = threading.Event(), threading.Event()
+    first_loading, first_release = threading.Event(), threading.Event()
+    calls = []
+    find = documents.find
+
+    def gated_find(query=None, projection=None):
+        result = find(query, projection)
+        if query == {"collection": "kb"}:
+            calls.append(query)
+            if len(calls) == 1:
+                reader_loading.set()
+                reader_release.wait(5)
+            elif len(calls) == 2:
+                first_loading.set()
+                # Gives the second upload the chance to load concurrently
+                first_release.wait(1)
+        return result
+
+    documents.find = gated_find
+    reader = threading.Thread(target=manager.get, args=("kb",))
+    reader.start()
+    assert reader_loading.wait(5)
+
+    first = threading.Thread(target=upload, args=(manager, documents, "one", "kb", ["one"]))
+    first.start()
+    time.sleep(0.1)
+    reader_release.set()
+    assert first_loading.wait(5)
+
+    second = threading.Thread(target=upload, args=(manager, documents, "two", "kb", ["two"]))
+    second.start()
+    second.join(0.5)
+    first_release.set()
+    for thread in (reader, first, second):
+        thread.join()
+
+    assert chunk_texts(manager.get("kb")) == ["one", "two"]
+    assert manager.loading == {}
+
+
+def test_eviction_and_reload(manager, documents):
+    embeddings = upload(manager, documents, "doc1", "kb1", ["a"])
+    upload(manager, documents, "doc2", "kb2", ["b"])
+    evicted = manager.get("kb1")
+    upload(manager, documents, "doc3", "kb3", ["c"])
+
+    assert not manager.is_loaded("kb2")
+    upload(manager, documents, "doc4", "kb2", ["d"])
+    assert not manager.is_loaded("kb1")
+    assert evicted.dead
+
+    results = manager.search("kb1", embeddings[:1], 5)
+    assert [r["text"] for r in results] == ["a"]
+    assert chunk_texts(manager.get("kb2")) == ["b", "d"]
+
+
+def test_out_of_date_snapshot_is_rebuilt(manager, documents, tmp_path):
+    upload(manager, documents, "doc1", "kb", ["a"])
+    documents.delete_one("doc1")
+    doc, _ = make_document("doc2", "kb", ["b"])
+    documents.insert_one(doc)
+
+    reloaded = CollectionManager(str(tmp_path), 2, documents)
+    assert chunk_texts(reloaded.get("kb")) == ["b"]
+
+
+def test_cold_load_does_not_block_loaded_collections(manager, documents):
+    embeddings = upload(manager, documents, "doc1", "hot", ["a"])
+    loading, release = threading.Event(), threading.Event()
+    find = documents.find
+
+    def slow_find(query=None, projection=None):
+        if query == {"collection": "cold"}:
+            loading.set()
+            release.wait(5)
+        return find(query, projection)
+
+    documents.find = slow_find
+    loader = threading.Thread(target=manager.get, args=("cold",))
+    loader.start()
+    try:
+        assert loading.wait(5)
+        results = manager.search("hot", embeddings[:1], 5)
+        assert [r["text"] for r in results] == ["a"]
+    finally:
+        release.set()
+        loader.join()
+
+
+def test_unknown_collection_is_not_cached(manager, documents):
+    upload(manager, documents, "doc1", "kb1", ["a"])
+    upload(manager, documents, "doc2", "kb2", ["b"])
+
+    for i in range(5):
+        assert manager.search(f"unknown{i}", np.zeros((1, DIMENSION)), 5) == []
+
+    assert manager.is_loaded("kb1")
+    assert manager.is_loaded("kb2")
+    assert not manager.is_loaded("unknown0")
+
+
+def test_legacy_documents_belong_to_default(manager, documents):
+    doc, _ = make_document("doc1", None, ["a"])
+    del doc["collection"]
+    documents.insert_one(doc)
+
+    assert chunk_texts(manager.get(DEFAULT_COLLECTION)) == ["a"]
+
+
+@pytest.mark.parametrize("params, expected", [
+    ({}, DEFAULT_COLLECTION),
+    ({"collection": ""}, DEFAULT_COLLECTION),
+    ({"collection": " kb_1 "}, "kb_1"),
+    ({"collection": "team-a"}, "team-a"),
+    ({"collection": "../etc"}, None),
+    ({"collection": "a b"}, None),
+    ({"collection": "x" * 65}, None),
+    ({"collection": 5}, None),
+    ({"collection": ["a"]}, None),
+    ({"collection": {"name": "a"}}, None),
+])
+def test_get_collection_name(params, expected):
+    assert get_collection_name(params) == expected